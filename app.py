@@ -14,15 +14,24 @@ Then visit http://localhost:5000 in your browser
 """
 
 import os
-import uuid
+import io
+import time
+import shutil
+import secrets
 import zipfile
 import tempfile
+import threading
+from contextlib import contextmanager
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from flask import Flask, request, render_template, send_file, flash, redirect, url_for, jsonify
 from werkzeug.utils import secure_filename
 import sys
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
 
 # Ensure current directory is in Python path
 sys.path.insert(0, os.path.dirname(__file__))
@@ -31,12 +40,25 @@ sys.path.insert(0, os.path.dirname(__file__))
 from logging_config import app_logger, access_logger, log_request, log_performance, get_logger
 
 # Import our existing image processing functions
-from main import process_image, create_square_image, add_white_outline
+from main import (process_image_bytes, create_square_image, add_white_outline,
+                  PROCESS_POOL_WORKERS, POOL_START_METHOD)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 PROCESSED_FOLDER = 'web_processed'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'tiff', 'tif', 'webp'}
+ALLOWED_SUFFIXES = tuple(f'.{ext}' for ext in ALLOWED_EXTENSIONS)
+MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB per file
+PROCESSED_MAX_AGE = 365 * 24 * 3600  # Processed files never change once written
+SESSION_TTL = 24 * 3600  # How long a batch stays downloadable, as promised on the results page
+CLEANUP_INTERVAL = 3600
+UPLOAD_CHUNK_SIZE = 64 * 1024
+BATCH_TIMEOUT = 600  # Upper bound on processing one upload batch, in seconds
+ZIP_BUFFER_SIZE = 64 * 1024  # Coalesce zipfile's many small writes
+ZIP_COMPRESSLEVEL = 1  # Favour speed whenever a compressing method is chosen
+ZIP_METHODS = {'stored': zipfile.ZIP_STORED, 'deflated': zipfile.ZIP_DEFLATED}
+if hasattr(zipfile, 'ZIP_ZSTANDARD'):  # Python 3.14+
+    ZIP_METHODS['zstd'] = zipfile.ZIP_ZSTANDARD
 
 # Load environment variables
 load_dotenv()
@@ -46,18 +68,181 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['PROCESSED_FOLDER'] = PROCESSED_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
 app.secret_key = os.getenv('SECRET_KEY', 'sticker-processing-secret-key')
+# Hand file downloads to a fronting server that honours X-Sendfile (Apache mod_xsendfile, lighttpd)
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE', '').lower() in ('1', 'true', 'yes')
+
+# PNG data is already deflated, so archives are stored uncompressed by default
+ZIP_COMPRESSION = ZIP_METHODS.get(os.getenv('ZIP_COMPRESSION', 'stored').lower(), zipfile.ZIP_STORED)
 
 # Telegram configuration
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 TELEGRAM_CHANNEL_ID = os.getenv('TELEGRAM_CHANNEL_ID')
 
+TELEGRAM_MESSAGE_TEMPLATE = """📬 *New Feedback*
+
+*Type:* {type}
+*Message:* {message}
+
+*From:* Sticker Processing Tool v1.0.0"""
+TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+
+def build_telegram_payload(channel_id):
+    """
+    Build the base sendMessage payload for channel_id (format: chat_id or chat_id:topic_id).
+    Raises ValueError if the topic id is not a number.
+    """
+    payload = {'parse_mode': 'Markdown'}
+    if ':' in channel_id:
+        chat_id, topic_id = channel_id.split(':', 1)
+        payload.update(chat_id=chat_id, message_thread_id=int(topic_id))
+    else:
+        payload['chat_id'] = channel_id
+    return payload
+
+# Resolve the target chat once; None means feedback cannot be sent
+TELEGRAM_PAYLOAD_BASE = None
+if TELEGRAM_CHANNEL_ID:
+    try:
+        TELEGRAM_PAYLOAD_BASE = build_telegram_payload(TELEGRAM_CHANNEL_ID)
+    except ValueError:
+        app_logger.error("Invalid TELEGRAM_CHANNEL_ID topic, feedback will fail", extra={
+            'channel_id': TELEGRAM_CHANNEL_ID
+        })
+
+# Reuse keep-alive connections to the Telegram API across feedback requests
+TELEGRAM_SESSION = requests.Session()
+TELEGRAM_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=10))
+
 # Create necessary directories
 Path(UPLOAD_FOLDER).mkdir(exist_ok=True)
 Path(PROCESSED_FOLDER).mkdir(exist_ok=True)
 
+# Image processing pool, created lazily so forked server workers each get their own
+_executor = None
+_executor_lock = threading.Lock()
+
 def allowed_file(filename):
     """Check if file has allowed extension"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    return bool(filename) and filename.lower().endswith(ALLOWED_SUFFIXES)
+
+def read_upload(file, max_size=MAX_FILE_SIZE):
+    """Read an uploaded file in chunks, returning None as soon as it exceeds max_size"""
+    buffer = io.BytesIO()
+    while chunk := file.stream.read(UPLOAD_CHUNK_SIZE):
+        if buffer.tell() + len(chunk) > max_size:
+            return None
+        buffer.write(chunk)
+    return buffer.getvalue()
+
+@contextmanager
+def open_archive(zip_path):
+    """Open a buffered ZIP archive for writing, or yield None when no archive is needed"""
+    if zip_path is None:
+        yield None
+        return
+    with open(zip_path, 'wb', buffering=ZIP_BUFFER_SIZE) as zip_file, \
+            zipfile.ZipFile(zip_file, 'w', ZIP_COMPRESSION, compresslevel=ZIP_COMPRESSLEVEL) as zipf:
+        yield zipf
+
+def summarize_errors(errors):
+    """Combine per-file (filename, reason) errors into a single flash message"""
+    details = ', '.join(f'{filename} ({reason})' for filename, reason in errors)
+    if len(errors) == 1:
+        return f'Could not process {details}'
+    return f'{len(errors)} files could not be processed: {details}'
+
+def get_executor():
+    """Return the shared process pool used for image processing"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=PROCESS_POOL_WORKERS,
+                mp_context=multiprocessing.get_context(POOL_START_METHOD)
+            )
+        return _executor
+
+def reset_executor(executor, terminate=False):
+    """
+    Drop a broken process pool so the next batch starts a fresh one.
+    With terminate, also kill its processes, e.g. when one is stuck on a job.
+    """
+    global _executor
+    with _executor_lock:
+        # Another request may already have replaced it with a healthy pool
+        if _executor is executor:
+            _executor = None
+    # ProcessPoolExecutor has no public way to stop running jobs before Python 3.14
+    processes = list((executor._processes or {}).values()) if terminate else []
+    executor.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+def submit_jobs(executor, jobs):
+    """Submit (image_bytes, filename) pairs to executor, returning a future -> index map"""
+    return {
+        executor.submit(process_image_bytes, data, filename): index
+        for index, (data, filename) in enumerate(jobs)
+    }
+
+def run_processing_jobs(jobs):
+    """
+    Process (image_bytes, filename) pairs, yielding (index, png_bytes, error) as each finishes.
+    Every job runs in the pool, so rembg sessions only ever live in its bounded processes.
+    """
+    executor = get_executor()
+    try:
+        futures = submit_jobs(executor, jobs)
+    except BrokenProcessPool:
+        # A pool process died while the pool was idle; retry the batch once on a fresh pool
+        reset_executor(executor)
+        executor = get_executor()
+        futures = submit_jobs(executor, jobs)
+    pending = set(futures)
+    try:
+        for future in as_completed(futures, timeout=BATCH_TIMEOUT):
+            pending.discard(future)
+            error = future.exception()
+            if isinstance(error, BrokenProcessPool):
+                reset_executor(executor)
+            yield futures[future], None if error else future.result(), error
+    except FuturesTimeoutError:
+        # Never block a request thread forever on a stuck or lost job, and do not
+        # leave it occupying the pool for the batches that follow
+        reset_executor(executor, terminate=True)
+        for future in pending:
+            future.cancel()
+            yield futures[future], None, TimeoutError('processing timed out')
+
+def cleanup_expired_sessions(max_age=SESSION_TTL):
+    """Delete session directories older than max_age seconds, returning how many were removed"""
+    cutoff = time.time() - max_age
+    removed = 0
+    for folder in (UPLOAD_FOLDER, PROCESSED_FOLDER):
+        for session_dir in Path(folder).iterdir():
+            try:
+                if session_dir.is_dir() and session_dir.stat().st_mtime < cutoff:
+                    shutil.rmtree(session_dir, ignore_errors=True)
+                    removed += 1
+            except OSError:
+                continue  # Removed concurrently by another worker
+    return removed
+
+def cleanup_loop():
+    """Periodically remove expired upload sessions so disk usage stays bounded"""
+    while True:
+        try:
+            removed = cleanup_expired_sessions()
+            if removed:
+                app_logger.info("Expired sessions removed", extra={
+                    'removed_count': removed,
+                    'max_age': SESSION_TTL
+                })
+        except Exception as e:
+            app_logger.error("Session cleanup failed", extra={'error': str(e)}, exc_info=True)
+        time.sleep(CLEANUP_INTERVAL)
+
+threading.Thread(target=cleanup_loop, name='session-cleanup', daemon=True).start()
 
 @app.route('/')
 def index():
@@ -90,34 +275,19 @@ def send_feedback():
             app_logger.error("Telegram not configured for feedback")
             return jsonify({'error': 'Telegram not configured'}), 500
 
-        # Format message for Telegram
-        telegram_message = f"""📬 *New Feedback*
-
-*Type:* {feedback_type.upper()}
-*Message:* {message}
+        if TELEGRAM_PAYLOAD_BASE is None:
+            app_logger.error("Feedback processing error", extra={
+                'error': 'invalid TELEGRAM_CHANNEL_ID topic',
+                'remote_addr': request.remote_addr
+            })
+            return jsonify({'error': 'Internal server error'}), 500
 
-*From:* Sticker Processing Tool v1.0.0"""
+        # Format message for Telegram
+        telegram_message = TELEGRAM_MESSAGE_TEMPLATE.format(type=feedback_type.upper(), message=message)
 
         # Send to Telegram
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-
-        # Handle topic IDs (format: chat_id:topic_id)
-        if ':' in TELEGRAM_CHANNEL_ID:
-            chat_id, topic_id = TELEGRAM_CHANNEL_ID.split(':', 1)
-            payload = {
-                'chat_id': chat_id,
-                'message_thread_id': int(topic_id),
-                'text': telegram_message,
-                'parse_mode': 'Markdown'
-            }
-        else:
-            payload = {
-                'chat_id': TELEGRAM_CHANNEL_ID,
-                'text': telegram_message,
-                'parse_mode': 'Markdown'
-            }
-
-        response = requests.post(url, json=payload, timeout=10)
+        payload = dict(TELEGRAM_PAYLOAD_BASE, text=telegram_message)
+        response = TELEGRAM_SESSION.post(TELEGRAM_API_URL, json=payload, timeout=10)
 
         if response.status_code == 200:
             app_logger.info("Feedback sent successfully", extra={
@@ -145,7 +315,7 @@ def send_feedback():
 @log_performance(app_logger)
 def upload_files():
     """Handle file uploads and processing"""
-    start_time = __import__('time').time()
+    start_time = time.time()
 
     if 'files' not in request.files:
         app_logger.warning("No files part in upload request", extra={
@@ -175,11 +345,8 @@ def upload_files():
         return redirect(request.url)
 
     # Create unique session ID for this batch
-    session_id = str(uuid.uuid4())
-    session_upload_dir = Path(UPLOAD_FOLDER) / session_id
+    session_id = secrets.token_urlsafe(12)
     session_processed_dir = Path(PROCESSED_FOLDER) / session_id
-
-    session_upload_dir.mkdir(exist_ok=True)
     session_processed_dir.mkdir(exist_ok=True)
 
     app_logger.info("Upload session started", extra={
@@ -188,86 +355,91 @@ def upload_files():
         'remote_addr': request.remote_addr
     })
 
-    processed_files = []
-    total_file_size = 0
+    errors = []  # (filename, reason), flashed once as a summary
 
+    # Pass 1: validate file names, splitting the uploads into accepted and rejected
+    valid_files, invalid_files = [], []
     for file in files:
         if file and file.filename and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-
-            # Check file size (max 10MB per file)
-            file.seek(0, 2)  # Seek to end
-            file_size = file.tell()
-            file.seek(0)  # Reset to beginning
-            total_file_size += file_size
-
-            if file_size > 10 * 1024 * 1024:  # 10MB
-                app_logger.warning("File too large", extra={
-                    'file_name': filename,
-                    'file_size': file_size,
-                    'max_size': 10 * 1024 * 1024,
-                    'session_id': session_id
-                })
-                flash(f'File {filename} is too large (max 10MB)', 'error')
-                continue
-
-            upload_path = session_upload_dir / filename
-            processed_path = session_processed_dir / f"{Path(filename).stem}_processed.png"
-
-            try:
-                # Save uploaded file
-                file.save(upload_path)
+            valid_files.append((secure_filename(file.filename), file))
+        else:
+            invalid_files.append(file)
+    for file in invalid_files:
+        app_logger.warning("Invalid file type", extra={
+            'file_name': getattr(file, 'filename', 'unknown'),
+            'session_id': session_id
+        })
+        errors.append((file.filename, 'invalid file type'))
+
+    # Pass 2: read uploads into memory, stopping early on any over the size limit
+    uploads = [(filename, read_upload(file)) for filename, file in valid_files]
+    for filename, data in uploads:
+        if data is None:
+            app_logger.warning("File too large", extra={
+                'file_name': filename,
+                'max_size': MAX_FILE_SIZE,
+                'session_id': session_id
+            })
+            errors.append((filename, 'too large, max 10MB'))
 
-                # Process the image
-                process_image(upload_path, processed_path, None)
-                processed_files.append(processed_path.name)
+    jobs = [(filename, len(data), data) for filename, data in uploads if data is not None]
+    total_file_size = sum(file_size for _, file_size, _ in jobs)
 
+    # Pass 3: process all uploads in parallel, adding each sticker to the ZIP as soon as it is ready
+    # A single sticker is downloaded directly, so it gets no archive
+    zip_path = None
+    if len(jobs) > 1:
+        zip_path = session_processed_dir / f"processed_stickers_{session_id[:8]}.zip"
+    completed = {}
+
+    with open_archive(zip_path) as zipf:
+        for index, png_data, error in run_processing_jobs([(data, filename) for filename, _, data in jobs]):
+            filename, file_size, _ = jobs[index]
+
+            if error is None:
+                processed_name = f"{Path(filename).stem}_processed.png"
+                (session_processed_dir / processed_name).write_bytes(png_data)
+                if zipf is not None:
+                    zipf.writestr(processed_name, png_data)
+                completed[index] = processed_name
                 app_logger.info("File processed successfully", extra={
                     'file_name': filename,
                     'session_id': session_id,
                     'file_size': file_size
                 })
-
-            except Exception as e:
-                error_msg = f'Error processing {filename}: {str(e)}'
+            else:
                 app_logger.error("File processing failed", extra={
                     'file_name': filename,
                     'session_id': session_id,
-                    'error': str(e)
-                }, exc_info=True)
-                flash(error_msg, 'error')
-        else:
-            app_logger.warning("Invalid file type", extra={
-                'file_name': getattr(file, 'filename', 'unknown'),
-                'session_id': session_id
-            })
-            flash(f'Invalid file type: {file.filename}', 'error')
+                    'error': str(error)
+                }, exc_info=error)
+                errors.append((filename, str(error)))
 
-    processing_time = __import__('time').time() - start_time
+    if errors:
+        flash(summarize_errors(errors), 'error')
 
-    if processed_files:
-        # Create ZIP archive
-        zip_path = session_processed_dir / f"processed_stickers_{session_id[:8]}.zip"
+    # Keep the results in upload order regardless of completion order
+    processed_files = [completed[index] for index in sorted(completed)]
 
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for processed_file in processed_files:
-                file_path = session_processed_dir / processed_file
-                zipf.write(file_path, processed_file)
+    processing_time = time.time() - start_time
 
+    if processed_files:
         app_logger.info("Upload session completed successfully", extra={
             'session_id': session_id,
             'processed_count': len(processed_files),
             'total_file_size': total_file_size,
             'processing_time': round(processing_time, 2),
-            'zip_size': zip_path.stat().st_size
+            'zip_size': zip_path.stat().st_size if zip_path else None
         })
 
         return render_template('results.html',
                               session_id=session_id,
                               processed_count=len(processed_files),
                               processed_files=processed_files,
-                              zip_filename=zip_path.name)
+                              zip_filename=zip_path.name if zip_path else None)
     else:
+        if zip_path:
+            zip_path.unlink(missing_ok=True)
         app_logger.warning("No files were successfully processed", extra={
             'session_id': session_id,
             'total_files': len(files),
@@ -282,7 +454,7 @@ def download_zip(session_id, filename):
     zip_path = Path(PROCESSED_FOLDER) / session_id / filename
 
     if zip_path.exists():
-        return send_file(zip_path, as_attachment=True, download_name=filename)
+        return send_file(zip_path, as_attachment=True, download_name=filename, max_age=PROCESSED_MAX_AGE)
     else:
         flash('File not found')
         return redirect(url_for('index'))
@@ -293,7 +465,7 @@ def download_file(session_id, filename):
     file_path = Path(PROCESSED_FOLDER) / session_id / filename
 
     if file_path.exists():
-        return send_file(file_path, as_attachment=True, download_name=filename)
+        return send_file(file_path, as_attachment=True, download_name=filename, max_age=PROCESSED_MAX_AGE)
     else:
         flash('File not found')
         return redirect(url_for('index'))
@@ -304,7 +476,7 @@ def preview_file(session_id, filename):
     file_path = Path(PROCESSED_FOLDER) / session_id / filename
 
     if file_path.exists():
-        return send_file(file_path, as_attachment=False)
+        return send_file(file_path, as_attachment=False, max_age=PROCESSED_MAX_AGE)
     else:
         return "File not found", 404
 
@@ -318,4 +490,5 @@ if __name__ == '__main__':
     app_logger.info("🔗 Health check: http://localhost:5000/health")
     app_logger.info("📊 Logging configured with level: %s", os.getenv('LOG_LEVEL', 'INFO'))
 
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Development server only; production runs under gunicorn (gunicorn -c gunicorn.conf.py app:app)
+    app.run(debug=os.getenv('FLASK_DEV', '').lower() in ('1', 'true', 'yes'), host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+"""
+Gunicorn configuration for the Sticker Processing web app
+
+The app is loaded once in the master and forked into threaded workers, so
+workers start quickly. rembg and its model are not part of that: they load
+lazily inside the forkserver processes of each worker's processing pool.
+
+Usage:
+    gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+import multiprocessing
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+# Image processing runs in each worker's process pool, so request threads need
+# little CPU. Stay within the pool budget (MAX_POOL_PROCESSES in main.py) so the
+# total number of rembg processes stays bounded.
+MAX_WORKERS = 4
+workers = max(1, int(os.getenv('GUNICORN_WORKERS') or min(multiprocessing.cpu_count(), MAX_WORKERS)))
+# The app splits its image processing pool budget across this many workers
+os.environ['GUNICORN_WORKERS'] = str(workers)
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+preload_app = True
+
+# Recycle workers periodically to bound memory growth
+max_requests = 1000
+max_requests_jitter = 50
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Pixel Kernels for Sticker Rendering
+
+This module composes the final sticker straight from the resized RGBA pixels:
+it centers the image on a transparent square canvas and draws the outline in
+one call, without building intermediate PIL images.
+
+The kernel is compiled with Numba when it is installed and JIT is enabled.
+Otherwise a vectorized NumPy/SciPy version with identical output is used.
+"""
+
+import numpy as np
+from scipy import ndimage
+
+# Numba is optional: it is pulled in by rembg, but JIT may be disabled (NUMBA_DISABLE_JIT=1)
+try:
+    import numba
+    from numba import njit, prange
+    HAS_NUMBA = not numba.config.DISABLE_JIT
+except ImportError:
+    numba = None
+    HAS_NUMBA = False
+
+# Alpha above which an outline would be all but invisible
+OPAQUE_ALPHA = 250
+
+def _div255_numpy(values):
+    """Divide by 255 with rounding, matching Pillow's blending arithmetic"""
+    values = values + 128
+    return ((values >> 8) + values) >> 8
+
+def _paste_numpy(content, x, y, out):
+    """Paste the image using its own alpha as the mask onto a transparent canvas"""
+    height, width = content.shape[:2]
+    out[:] = 0
+    pixels = content.astype(np.uint32)
+    out[y:y + height, x:x + width] = _div255_numpy(pixels * pixels[..., 3:4])
+
+def _outline_numpy(outline, radius, scratch, out):
+    """NumPy/SciPy implementation of the in-place outline kernel"""
+    # Dilate alpha (separable max filter) and blend the outline over the difference
+    alpha = out[..., 3]
+    ndimage.maximum_filter(alpha, size=radius * 2 + 1, mode='nearest', output=scratch)
+    mask = (scratch - alpha).astype(np.uint32)[..., None]
+    out[:] = _div255_numpy(out * (255 - mask) + outline.astype(np.uint32) * mask)
+
+def _compose_numpy(content, x, y, outline, radius, scratch, out):
+    """NumPy/SciPy implementation of the paste + outline kernel"""
+    _paste_numpy(content, x, y, out)
+    _outline_numpy(outline, radius, scratch, out)
+
+if HAS_NUMBA:
+    @njit(inline='always')
+    def _div255(value):
+        value += 128
+        return ((value >> 8) + value) >> 8
+
+    _READONLY_RGBA = numba.types.Array(numba.types.uint8, 3, 'C', readonly=True)
+
+    # Explicit signatures compile at import; cache=True keeps that to the first run
+    @njit(
+        numba.void(numba.uint8[::1], numba.int64, numba.uint8[:, ::1], numba.uint8[:, :, ::1]),
+        cache=True, parallel=True
+    )
+    def _outline_numba(outline, radius, scratch, out):
+        """Numba implementation of the in-place outline kernel"""
+        size_y, size_x = out.shape[0], out.shape[1]
+
+        # Horizontal pass of the alpha dilation
+        for i in prange(size_y):
+            for j in range(size_x):
+                peak = 0
+                for k in range(max(j - radius, 0), min(j + radius + 1, size_x)):
+                    peak = max(peak, out[i, k, 3])
+                scratch[i, j] = peak
+
+        # Vertical pass, blending the outline where the dilated alpha exceeds the original
+        for i in prange(size_y):
+            top, bottom = max(i - radius, 0), min(i + radius + 1, size_y)
+            for j in range(size_x):
+                peak = 0
+                for k in range(top, bottom):
+                    peak = max(peak, scratch[k, j])
+                mask = np.int64(peak) - np.int64(out[i, j, 3])
+                if mask:
+                    for c in range(4):
+                        out[i, j, c] = _div255(np.int64(out[i, j, c]) * (255 - mask)
+                                               + np.int64(outline[c]) * mask)
+
+    @njit(
+        numba.void(_READONLY_RGBA, numba.int64, numba.int64, numba.uint8[::1],
+                   numba.int64, numba.uint8[:, ::1], numba.uint8[:, :, ::1]),
+        cache=True, parallel=True
+    )
+    def _compose_numba(content, x, y, outline, radius, scratch, out):
+        """Numba implementation of the paste + outline kernel"""
+        height, width = content.shape[0], content.shape[1]
+        size_y, size_x = out.shape[0], out.shape[1]
+
+        # Paste the image using its own alpha as the mask onto a transparent canvas
+        for i in prange(size_y):
+            for j in range(size_x):
+                for c in range(4):
+                    out[i, j, c] = 0
+        for i in prange(height):
+            for j in range(width):
+                mask = np.int64(content[i, j, 3])
+                for c in range(4):
+                    out[y + i, x + j, c] = _div255(np.int64(content[i, j, c]) * mask)
+
+        _outline_numba(outline, radius, scratch, out)
+
+def add_outline(pixels, outline, radius, scratch=None):
+    """
+    Draw an outline around the non-transparent pixels of an RGBA image in place.
+
+    pixels is a writable (height, width, 4) uint8 array, outline a (4,) uint8
+    RGBA color and radius the outline width in pixels. Returns pixels.
+    """
+    outline = np.ascontiguousarray(outline, dtype=np.uint8)
+    if scratch is None:
+        scratch = np.empty(pixels.shape[:2], np.uint8)
+
+    if HAS_NUMBA and pixels.flags.c_contiguous:
+        _outline_numba(outline, radius, scratch, pixels)
+    else:
+        _outline_numpy(outline, radius, scratch, pixels)
+    return pixels
+
+def compose_sticker(content, size, outline, radius, out=None, scratch=None):
+    """
+    Center an RGBA image on a transparent size x size canvas and add an outline.
+
+    content is a (height, width, 4) uint8 array no larger than size, outline a
+    (4,) uint8 RGBA color and radius the outline width in pixels. out and scratch
+    may be passed in to reuse buffers of shape (size, size, 4) and (size, size).
+    Returns the (size, size, 4) uint8 sticker.
+    """
+    content = np.ascontiguousarray(content, dtype=np.uint8)
+    outline = np.ascontiguousarray(outline, dtype=np.uint8)
+    if out is None:
+        out = np.empty((size, size, 4), np.uint8)
+    if scratch is None:
+        scratch = np.empty((size, size), np.uint8)
+
+    height, width = content.shape[:2]
+    x = (size - width) // 2
+    y = (size - height) // 2
+
+    # Nothing to outline: empty masks (rembg found no subject) and opaque
+    # images that cover the whole canvas, e.g. a square photo rembg kept whole
+    alpha = content[..., 3]
+    if not alpha.max():
+        out[:] = 0
+        return out
+    if width == height == size and alpha.min() > OPAQUE_ALPHA:
+        _paste_numpy(content, x, y, out)
+        return out
+
+    if HAS_NUMBA:
+        # The compiled signature takes a read-only view, so PIL-backed arrays need no copy
+        content = content.view()
+        content.flags.writeable = False
+        _compose_numba(content, x, y, outline, radius, scratch, out)
+    else:
+        _compose_numpy(content, x, y, outline, radius, scratch, out)
+    return out
@@ -7,10 +7,20 @@ including file handlers, formatters, and structured logging support.
 """
 
 import os
+import queue
+import atexit
+import functools
 import logging
 import logging.handlers
+from time import perf_counter_ns
 from pathlib import Path
-# Try to import JSON logger, fallback to standard if not available
+# Prefer orjson for JSON logs, then JSON logger, fallback to standard if neither is available
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    orjson = None
+    HAS_ORJSON = False
 try:
     from pythonjsonlogger import jsonlogger
     HAS_JSON_LOGGER = True
@@ -48,8 +58,101 @@ def get_log_format():
     """Get log format from environment variable"""
     return os.getenv('LOG_FORMAT', 'json').lower()
 
+# Parsed once at import
+LOG_LEVEL = get_log_level()
+LOG_FORMAT = get_log_format()
+
+# Attributes every LogRecord has; anything else was passed in via extra=
+RESERVED_ATTRS = frozenset(logging.makeLogRecord({}).__dict__) | {'message', 'asctime'}
+
+class OrjsonFormatter(logging.Formatter):
+    """
+    JSON formatter backed by orjson, with the same fields as the JSON logger
+    output except that the timestamp is the numeric 'created' epoch time.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._last = (None, None)
+
+    def format(self, record):
+        # All handlers share this formatter, so serialize each record only once
+        last_record, last_line = self._last
+        if last_record is record:
+            return last_line
+
+        entry = {
+            'created': record.created,
+            'name': record.name,
+            'levelname': record.levelname,
+            'module': record.module,
+            'funcName': record.funcName,
+            'lineno': record.lineno,
+            'message': record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in RESERVED_ATTRS:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc_info'] = record.exc_text
+        if record.stack_info:
+            entry['stack_info'] = self.formatStack(record.stack_info)
+
+        line = orjson.dumps(entry, default=str).decode()
+        self._last = (record, line)
+        return line
+
+class LoggerNameFilter(logging.Filter):
+    """Only pass records from the given logger names"""
+
+    def __init__(self, *names):
+        super().__init__()
+        self.names = frozenset(names)
+
+    def filter(self, record):
+        return record.name in self.names
+
+class LocalQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler for an in-process queue: records are handed over as-is"""
+
+    def prepare(self, record):
+        # Nothing is pickled, so keep exc_info and args for the file formatters
+        return record
+
+# File handlers run on the listener thread; see setup_logging
+_queue_handler = None
+_listener = None
+
+def _start_listener(handlers):
+    """Start a listener thread writing queued records to the given handlers"""
+    global _listener
+    log_queue = queue.Queue(-1)
+    _queue_handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+def _stop_listener():
+    """Flush queued records to the log files and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def _restart_listener_after_fork():
+    """The listener thread does not survive fork; give the child its own"""
+    if _listener is not None:
+        _start_listener(_listener.handlers)
+
+atexit.register(_stop_listener)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listener_after_fork)
+
 def create_json_formatter():
     """Create JSON formatter for structured logging"""
+    if HAS_ORJSON:
+        return OrjsonFormatter()
     if HAS_JSON_LOGGER and jsonlogger:
         return jsonlogger.JsonFormatter(
             '%(asctime)s %(name)s %(levelname)s %(module)s %(funcName)s %(lineno)d %(message)s',
@@ -69,13 +172,16 @@ def create_human_formatter():
 def setup_logging():
     """Setup comprehensive logging configuration"""
 
-    # Get configuration from environment
-    log_level = get_log_level()
-    log_format = get_log_format()
+    # Configuration parsed from the environment at import
+    log_level = LOG_LEVEL
+    log_format = LOG_FORMAT
+
+    global _queue_handler
 
     # Clear any existing handlers
     root_logger = logging.getLogger()
     root_logger.handlers.clear()
+    _stop_listener()
 
     # Set root logger level
     root_logger.setLevel(log_level)
@@ -101,6 +207,7 @@ def setup_logging():
         ('access.log', logging.INFO)
     ]
 
+    handlers = []
     for filename, level in file_handlers:
         file_handler = logging.handlers.RotatingFileHandler(
             LOGS_DIR / filename,
@@ -110,15 +217,18 @@ def setup_logging():
         file_handler.setLevel(level)
         file_handler.setFormatter(formatter)
 
-        # Add filter for specific loggers
+        # Add filter for specific loggers (error.log is covered by its level)
         if filename == 'processing.log':
-            file_handler.addFilter(lambda record: record.name in ['main', 'processing'])
+            file_handler.addFilter(LoggerNameFilter('main', 'processing'))
         elif filename == 'access.log':
-            file_handler.addFilter(lambda record: record.name == 'access')
-        elif filename == 'error.log':
-            file_handler.addFilter(lambda record: record.levelno >= logging.ERROR)
+            file_handler.addFilter(LoggerNameFilter('access'))
+
+        handlers.append(file_handler)
 
-        root_logger.addHandler(file_handler)
+    # Write log files from a background thread so logging never blocks on disk I/O
+    _queue_handler = LocalQueueHandler(queue.Queue(-1))
+    _start_listener(handlers)
+    root_logger.addHandler(_queue_handler)
 
     # Create specific loggers
     loggers = {
@@ -148,40 +258,39 @@ def get_logger(name):
 def log_performance(logger=None):
     """Decorator to log function performance"""
     def decorator(func):
-        def wrapper(*args, **kwargs):
-            import time
-            start_time = time.time()
+        name = func.__name__
 
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
             log = logger or logging.getLogger(func.__module__)
-            log.info(f"Starting {func.__name__}", extra={
-                'function': func.__name__,
-                'action': 'start'
-            })
+            # Skip building the start/complete records entirely when INFO is off
+            verbose = log.isEnabledFor(logging.INFO)
+            if verbose:
+                log.info("Starting %s", name, extra={
+                    'function': name,
+                    'action': 'start'
+                })
 
+            start_time = perf_counter_ns()
             try:
                 result = func(*args, **kwargs)
-                end_time = time.time()
-                duration = end_time - start_time
-
-                log.info(f"Completed {func.__name__}", extra={
-                    'function': func.__name__,
-                    'action': 'complete',
-                    'duration_ms': round(duration * 1000, 2)
-                })
-
-                return result
             except Exception as e:
-                end_time = time.time()
-                duration = end_time - start_time
-
-                log.error(f"Failed {func.__name__}: {str(e)}", extra={
-                    'function': func.__name__,
+                log.error("Failed %s: %s", name, e, extra={
+                    'function': name,
                     'action': 'error',
-                    'duration_ms': round(duration * 1000, 2),
+                    'duration_us': (perf_counter_ns() - start_time) // 1000,
                     'error': str(e)
                 })
                 raise
 
+            if verbose:
+                log.info("Completed %s", name, extra={
+                    'function': name,
+                    'action': 'complete',
+                    'duration_us': (perf_counter_ns() - start_time) // 1000
+                })
+            return result
+
         return wrapper
     return decorator
 
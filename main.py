@@ -9,7 +9,7 @@ This script monitors the 'new' folder for new image files, processes them by:
 4. Moving original files to 'old' folder
 
 Requirements:
-- pip install rembg pillow watchdog
+- pip install rembg pillow numpy scipy watchdog
 
 Usage:
     python main.py
@@ -19,36 +19,109 @@ The script runs continuously, monitoring the 'new' folder.
 
 import os
 import sys
-import time
 import io
+import importlib.util
+import select
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from PIL import Image, ImageFilter, ImageDraw, ImageMath
-import rembg
-try:
-    from watchdog.observers import Observer
-    from watchdog.events import FileSystemEventHandler
-except ImportError:
-    pass  # Will be checked later
+import numpy as np
+from PIL import Image, ImageDraw
+# rembg (ONNX Runtime) and the folder watchers are imported on first use, see
+# get_session() and create_observer(), so importing this module stays cheap
 
 # Import logging configuration
 from logging_config import main_logger, processing_logger, log_performance
+from kernels import compose_sticker, add_outline, OPAQUE_ALPHA
+
+STICKER_SIZE = 512
+OUTLINE_WIDTH = 6  # 6px ≈ 0.5mm at 300 DPI
+OUTLINE_COLOR = (235, 225, 215, 255)  # Subtle beige-brown-gray pastel
+OUTLINE_RGBA = np.array(OUTLINE_COLOR, np.uint8)
+# Shrink large images by an integer box reduction before LANCZOS; 3.0 is visually lossless
+REDUCING_GAP = 3.0
+# Fastest zlib level: optimize=True costs ~25x the encode time for ~45% smaller files
+PNG_COMPRESS_LEVEL = 1
+# Largest side handed to rembg; its model runs at 320px and the sticker is 512px
+REMBG_MAX_SIZE = 1024
+
+# Each pool process holds its own rembg session (several hundred MB of RSS), so the
+# process count is one budget per host, split across gunicorn's workers. Every worker
+# needs at least one process, so the budget only holds for up to MAX_POOL_PROCESSES
+# workers; gunicorn.conf.py defaults to no more than that.
+MAX_POOL_PROCESSES = 4
+_gunicorn_workers = max(1, int(os.getenv('GUNICORN_WORKERS') or 1))
+if _gunicorn_workers > MAX_POOL_PROCESSES and not os.getenv('PROCESS_POOL_WORKERS'):
+    main_logger.warning("GUNICORN_WORKERS=%d exceeds the pool budget of %d processes, "
+                        "running one pool process per worker", _gunicorn_workers, MAX_POOL_PROCESSES)
+PROCESS_POOL_WORKERS = int(os.getenv('PROCESS_POOL_WORKERS') or max(
+    1, min(MAX_POOL_PROCESSES, os.cpu_count() or 1) // _gunicorn_workers
+))
+# Forking after rembg/numba are imported is unsafe; start workers from a clean process
+POOL_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# One rembg session per process; building it loads the ONNX model from disk
+_session = None
+_session_lock = threading.Lock()
+
+# Sticker and dilation buffers, reused for every image a thread processes
+_buffers = threading.local()
+
+def get_sticker_buffers():
+    """Return this thread's (sticker, scratch) buffers, allocating them on first use"""
+    try:
+        return _buffers.sticker, _buffers.scratch
+    except AttributeError:
+        _buffers.sticker = np.empty((STICKER_SIZE, STICKER_SIZE, 4), np.uint8)
+        _buffers.scratch = np.empty((STICKER_SIZE, STICKER_SIZE), np.uint8)
+        return _buffers.sticker, _buffers.scratch
 
-def create_square_image(img, size=512):
+def get_session():
     """
-    Resize image to square while maintaining aspect ratio and centering.
-    Fills background with transparency for PNG or white for other formats.
+    Return the process-wide rembg session, creating it on first use.
+    The model is taken from REMBG_MODEL (default: u2net).
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                import rembg
+                model_name = os.getenv('REMBG_MODEL', 'u2net')
+                processing_logger.info("Loading rembg model", extra={'model': model_name})
+                _session = rembg.new_session(model_name)
+    return _session
+
+def resize_to_fit(img, size=512):
+    """
+    Resize image to fit within a size x size square, maintaining aspect ratio.
     """
     # Calculate scaling to fit within the square
     original_width, original_height = img.size
     scale = min(size / original_width, size / original_height)
-    
+
     # Calculate new size maintaining aspect ratio
     new_width = int(original_width * scale)
     new_height = int(original_height * scale)
-    
+
+    # Pillow drops reducing_gap for RGBA, so resize the premultiplied image ourselves
+    if img.mode == 'RGBA':
+        img_resized = img.convert('RGBa').resize((new_width, new_height), Image.Resampling.LANCZOS,
+                                                 reducing_gap=REDUCING_GAP)
+        return img_resized.convert('RGBA')
+    return img.resize((new_width, new_height), Image.Resampling.LANCZOS, reducing_gap=REDUCING_GAP)
+
+def create_square_image(img, size=512):
+    """
+    Resize image to square while maintaining aspect ratio and centering.
+    Fills background with transparency for PNG or white for other formats.
+    """
     # Resize the image
-    img_resized = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-    
+    img_resized = resize_to_fit(img, size)
+    new_width, new_height = img_resized.size
+
     # Create a new square image with transparent background
     if img_resized.mode == 'RGBA':
         square_img = Image.new('RGBA', (size, size), (0, 0, 0, 0))
@@ -75,28 +148,40 @@ def add_white_outline(img, outline_width=6):
     if img.mode != 'RGBA':
         return img
 
-    # Get the alpha channel
-    alpha = img.split()[-1]
+    # Work on a writable copy of the pixels
+    pixels = np.array(img)
+    alpha = pixels[..., 3]
 
-    # Expand the alpha channel to create the outline area
-    expanded_alpha = alpha.filter(ImageFilter.MaxFilter(outline_width * 2 + 1))
-
-    # Create outline mask: expanded area minus original area
-    outline_mask = ImageMath.unsafe_eval("max(a - b, 0)", a=expanded_alpha, b=alpha).convert('L')
-
-    # Create subtle beige-brown-gray outline image
-    outline_color = (235, 225, 215, 255)  # Subtle beige-brown-gray pastel
-    outline_img = Image.new('RGBA', img.size, outline_color)
+    # Uniform or near-opaque alpha leaves nothing (visible) to outline
+    alpha_min = alpha.min()
+    if alpha_min == alpha.max() or alpha_min > OPAQUE_ALPHA:
+        return img
 
-    # Composite: outline where mask is set, original image elsewhere
-    result = Image.composite(outline_img, img, outline_mask)
+    # Dilate the alpha channel and blend the subtle beige-brown-gray outline into
+    # the area it grew by, in one pass over the pixels
+    return Image.fromarray(add_outline(pixels, OUTLINE_RGBA, outline_width))
 
-    return result
+def read_source(path):
+    """
+    Read a source image file in one pass. Where supported, tell the kernel the
+    read is sequential and drop the file from the page cache afterwards, since
+    each source is read exactly once before being moved to the old folder.
+    """
+    with open(path, 'rb') as source:
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(source.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        data = source.read()
+        if hasattr(os, 'posix_fadvise'):
+            os.posix_fadvise(source.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    return data
 
 @log_performance(processing_logger)
-def process_image(input_path, output_path, old_path):
+def process_image(input_path, output_path, old_path, session=None):
     """
-    Process a single image: remove background and resize to 512x512
+    Process a single image: remove background and resize to 512x512.
+    input_path and output_path may also be named binary file objects
+    (e.g. io.BytesIO with a name attribute) to keep the image in memory.
+    session is the rembg session to use; defaults to get_session().
     """
     try:
         processing_logger.info("Starting image processing", extra={
@@ -104,9 +189,16 @@ def process_image(input_path, output_path, old_path):
             'output_file': str(output_path.name)
         })
 
+        # Read the input image once; everything below works on these bytes
+        if hasattr(input_path, 'read'):
+            input_path.seek(0)
+            input_data = input_path.read()
+        else:
+            input_data = read_source(input_path)
+
         # First, validate the input image
         try:
-            with Image.open(input_path) as test_img:
+            with Image.open(io.BytesIO(input_data)) as test_img:
                 test_img.verify()  # Verify the image is not corrupted
         except Exception as e:
             processing_logger.error("Invalid input image", extra={
@@ -115,45 +207,58 @@ def process_image(input_path, output_path, old_path):
             })
             return
 
-        # Read the input image
-        with open(input_path, 'rb') as input_file:
-            input_data = input_file.read()
+        # Decode once, shrinking oversized images first: the sticker is only 512px.
+        # thumbnail() lets JPEGs decode straight at a reduced scale.
+        source_img = Image.open(io.BytesIO(input_data))
+        source_img.thumbnail((REMBG_MAX_SIZE, REMBG_MAX_SIZE), Image.Resampling.LANCZOS)
 
         # Try background removal, fallback to original if it fails
         try:
-            output_data = rembg.remove(input_data)
-            if isinstance(output_data, bytes) and len(output_data) > 100:  # Basic validation
-                processing_logger.info("Background removal completed", extra={
-                    'input_file': str(input_path.name),
-                    'output_size': len(output_data)
-                })
-                img = Image.open(io.BytesIO(output_data))
-            else:
+            if session is None:
+                session = get_session()
+            from rembg import remove
+            img = remove(source_img, session=session)  # PIL in, PIL out: no re-encoding
+            if not isinstance(img, Image.Image):  # Basic validation
                 raise ValueError("Invalid rembg output")
+            processing_logger.info("Background removal completed", extra={
+                'input_file': str(input_path.name),
+                'image_size': img.size
+            })
+        except ImportError:
+            raise  # A missing rembg must not quietly ship stickers with their background
         except Exception as e:
             processing_logger.warning("Background removal failed, using fallback", extra={
                 'input_file': str(input_path.name),
                 'error': str(e)
             })
             # Fallback: use original image
-            img = Image.open(input_path)
+            img = source_img
 
         # Convert to RGBA if not already (for transparency support)
         if img.mode != 'RGBA':
             img = img.convert('RGBA')
 
-        # Resize to 512x512 square
-        square_img = create_square_image(img, 512)
-
-        # Add subtle beige-brown-gray outline
-        square_img = add_white_outline(square_img, 6)  # 6px ≈ 0.5mm at 300 DPI
-
-        # Save the processed image
-        square_img.save(output_path, 'PNG', optimize=True)
+        # Resize to fit 512x512, then center it and add the subtle beige-brown-gray
+        # outline in a single pass over the pixels
+        # The sticker buffer is reused by the next image, so square_img must not outlive this call
+        img_resized = resize_to_fit(img, STICKER_SIZE)
+        sticker, scratch = get_sticker_buffers()
+        compose_sticker(np.asarray(img_resized), STICKER_SIZE, OUTLINE_RGBA, OUTLINE_WIDTH,
+                        out=sticker, scratch=scratch)
+        square_img = Image.fromarray(sticker)
+
+        # Save the processed image, taking the size from the write position
+        if hasattr(output_path, 'write'):
+            square_img.save(output_path, 'PNG', compress_level=PNG_COMPRESS_LEVEL)
+            output_size = output_path.tell()
+        else:
+            with open(output_path, 'wb') as output_file:
+                square_img.save(output_file, 'PNG', compress_level=PNG_COMPRESS_LEVEL)
+                output_size = output_file.tell()
         processing_logger.info("Image processing completed", extra={
             'input_file': str(input_path.name),
             'output_file': str(output_path.name),
-            'output_size': output_path.stat().st_size if output_path.exists() else 0
+            'output_size': output_size
         })
 
         # Move original to old folder
@@ -170,19 +275,50 @@ def process_image(input_path, output_path, old_path):
             'error': str(e)
         }, exc_info=True)
 
-class ImageHandler(FileSystemEventHandler):
-    def __init__(self, new_folder, processed_folder, old_folder):
+def process_image_bytes(input_data, filename):
+    """
+    Process an in-memory image and return the finished sticker as PNG bytes.
+    Raises ValueError if no sticker could be produced.
+    """
+    source = io.BytesIO(input_data)
+    source.name = filename
+    result = io.BytesIO()
+    result.name = f"{Path(filename).stem}_processed.png"
+
+    process_image(source, result, None)
+
+    if not result.tell():
+        raise ValueError("Image could not be processed")
+    return result.getvalue()
+
+def create_executor():
+    """Start a process pool for image processing; each worker loads its rembg session on first use"""
+    return ProcessPoolExecutor(
+        max_workers=PROCESS_POOL_WORKERS,
+        mp_context=multiprocessing.get_context(POOL_START_METHOD)
+    )
+
+class ImageHandler:
+    def __init__(self, new_folder, processed_folder, old_folder, executor):
         self.new_folder = Path(new_folder)
         self.processed_folder = Path(processed_folder)
         self.old_folder = Path(old_folder)
-        self.supported_formats = {'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.webp'}
+        self.executor = executor
+        self.supported_formats = frozenset({'.jpg', '.jpeg', '.png', '.bmp', '.tiff', '.tif', '.webp'})
 
-    def on_created(self, event):
-        if not event.is_directory:
-            file_path = Path(event.src_path)
-            if file_path.suffix.lower() in self.supported_formats:
-                main_logger.info("New image detected: %s", file_path.name)
-                self.process_file(file_path)
+    def dispatch(self, event):
+        # Called by the watchdog Observer for every event; only new files matter
+        if event.event_type == 'created' and not event.is_directory:
+            self.on_file(event.src_path)
+
+    def on_file(self, src_path):
+        # Filter on the raw path string; only build a Path for supported images
+        if os.path.splitext(src_path)[1].lower() not in self.supported_formats:
+            return
+        file_path = Path(src_path)
+        main_logger.info("New image detected: %s", file_path.name)
+        future = self.process_file(file_path)
+        future.add_done_callback(lambda f, name=file_path.name: log_job_result(f, name))
 
     def process_file(self, input_path):
         # Ensure input_path is a Path object
@@ -198,7 +334,79 @@ class ImageHandler(FileSystemEventHandler):
         output_path = self.processed_folder / output_filename
         old_path = self.old_folder / name
 
-        process_image(input_path, output_path, old_path)
+        # Runs in a worker process; returns the future so callers can wait on it
+        try:
+            return self.executor.submit(process_image, input_path, output_path, old_path)
+        except BrokenProcessPool:
+            # A worker died and took the pool with it; replace the pool and retry once
+            main_logger.warning("Processing pool broke, starting a new one")
+            broken, self.executor = self.executor, create_executor()
+            broken.shutdown(wait=False)
+            return self.executor.submit(process_image, input_path, output_path, old_path)
+
+class InotifyObserver:
+    """
+    Minimal stand-in for the watchdog Observer on Linux. A single thread
+    drains all pending inotify events per wakeup and hands the file names
+    to handler.on_file. Files are reported once fully written or moved in.
+    """
+
+    def __init__(self, handler, folder):
+        from inotify_simple import INotify, flags
+        self.handler = handler
+        self.folder = str(folder)
+        self._flags = flags
+        self._inotify = INotify()
+        self._inotify.add_watch(self.folder, flags.CLOSE_WRITE | flags.MOVED_TO)
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = threading.Thread(target=self._run, name='inotify-observer', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        os.write(self._wake_w, b'\0')
+
+    def join(self):
+        self._thread.join()
+        self._inotify.close()
+        os.close(self._wake_r)
+        os.close(self._wake_w)
+
+    def _run(self):
+        while True:
+            ready, _, _ = select.select([self._inotify, self._wake_r], [], [])
+            if self._wake_r in ready:
+                return
+            for event in self._inotify.read(timeout=0):
+                if event.mask & self._flags.ISDIR:
+                    continue
+                # One bad event must not stop the folder from being watched
+                try:
+                    self.handler.on_file(os.path.join(self.folder, event.name))
+                except Exception as e:
+                    main_logger.error("Failed to handle %s: %s", event.name, e, exc_info=True)
+
+def create_observer(handler, folder):
+    """
+    Watch folder for new files, using inotify directly on Linux when
+    inotify_simple is installed and the watchdog Observer otherwise.
+    Raises ImportError if neither is available.
+    """
+    try:
+        return InotifyObserver(handler, folder)
+    except ImportError:
+        from watchdog.observers import Observer
+        observer = Observer()
+        observer.schedule(handler, str(folder), recursive=False)
+        return observer
+
+def log_job_result(future, name):
+    """Log a processing job that failed outside of process_image itself"""
+    try:
+        future.result()
+    except Exception as e:
+        main_logger.error("Processing worker failed for %s: %s", name, e)
 
 def main():
     # Define folders
@@ -212,38 +420,50 @@ def main():
     processed_folder.mkdir(exist_ok=True)
     old_folder.mkdir(exist_ok=True)
 
+    # rembg is imported lazily by the workers; make sure it is there before starting
+    if importlib.util.find_spec('rembg') is None:
+        main_logger.error("Required packages not installed.")
+        main_logger.error("Please run: pip install rembg pillow watchdog")
+        sys.exit(1)
+
     main_logger.info("Monitoring 'new' folder for new images...")
     main_logger.info("Processed images will be saved to: %s", processed_folder)
     main_logger.info("Original images will be moved to: %s", old_folder)
     main_logger.info("Press Ctrl+C to stop.")
-    # Create event handler instance
-    event_handler = ImageHandler(new_folder, processed_folder, old_folder)
+    # Create event handler instance; it owns the processing pool and replaces it if it breaks
+    event_handler = ImageHandler(new_folder, processed_folder, old_folder, create_executor())
 
     main_logger.info("Processing existing files in 'new' folder...")
+    futures = {}
     for file_path in new_folder.iterdir():
         if file_path.is_file() and file_path.suffix.lower() in event_handler.supported_formats:
             main_logger.info("Found existing image: %s", file_path.name)
-            event_handler.process_file(file_path)
+            futures[event_handler.process_file(file_path)] = file_path.name
+    for future in as_completed(futures):
+        log_job_result(future, futures[future])
     main_logger.info("Finished processing existing files.")
 
-    # Check if watchdog is available
+    # Check if a folder watcher is available
     try:
-        observer = Observer()
-        observer.schedule(event_handler, str(new_folder), recursive=False)
-        observer.start()
-        main_logger.info("File monitoring started. Press Ctrl+C to stop.")
-
-        try:
-            while True:
-                time.sleep(1)
-        except KeyboardInterrupt:
-            observer.stop()
-            main_logger.info("Monitoring stopped by user.")
-        observer.join()
-
-    except NameError:
+        observer = create_observer(event_handler, new_folder)
+    except ImportError:
         main_logger.error("Required packages not installed.")
         main_logger.error("Please run: pip install rembg pillow watchdog")
         sys.exit(1)
 
+    observer.start()
+    main_logger.info("File monitoring started. Press Ctrl+C to stop.")
+
+    # Block until Ctrl+C or a termination signal instead of polling
+    stop_event = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop_event.set())
+    stop_event.wait()
+
+    observer.stop()
+    main_logger.info("Monitoring stopped by user.")
+    observer.join()
+    event_handler.executor.shutdown(wait=True)
+
+if __name__ == '__main__':
     main()